@@ -0,0 +1,680 @@
+# -*- coding: utf-8 -*-
+"""
+Parser and data classes for xml files exported from SMS Backup and
+Restore App. Does not depend on tkinter, so it can also be used headless,
+e.g. by SMS_Backup_Server.py.
+
+"""
+
+import re, time
+from xml.etree.ElementTree import XMLParser
+
+
+#plan:
+# - read file line by line - ok
+# - correct line on the fly - ok
+# - sent/serve corrected line to xml-parser (SAX or iterparse style) ok
+# - event is e.g. a <sms>, create a namedtuple for each entry with all data
+# - make dict: add namedtuple, keys are conversation partner, items are lists of smss
+# - also need list of conversation partners? (or use keys of dict?)
+# - another list of all smss, sorted by date (or have a special entry 'all' in dict?)
+
+def normalise_address(address):
+    """Return phone number *address* without the separators that may be
+    formatted into it differently between messages.
+
+    """
+    return re.sub(r"[\s\-()./]", "", address)
+
+# tags of the records, which can be selected by XML_Target:
+RECORD_TYPES = ('sms', 'mms', 'call')
+
+# placeholder used as 'From' address of sent mms instead of the own number:
+INSERT_ADDRESS_TOKEN = normalise_address("insert-address-token")
+
+
+class Call:
+    def __init__(self, attrib):
+        """Creates a call data set. *attrib* is the attribute dict
+        returned by the xml reader.
+
+        """
+
+        # from here: https://synctech.com.au/sms-backup-restore/fields-in-xml-backup-files/
+        #    number - The phone number of the call.
+        #    duration - The duration of the call in seconds.
+        #    date - The Java date representation (including millisecond) of the time when the message was sent/received. Check out www.epochconverter.com for information on how to do the conversion from other languages to Java.
+        #    type - 1 = Incoming, 2 = Outgoing, 3 = Missed, 4 = Voicemail, 5 = Rejected, 6 = Refused List.
+        #    presentation - caller id presentation info. 1 = Allowed, 2 = Restricted, 3 = Unknown, 4 = Payphone.
+        #    readable_date - Optional field that has the date in a human readable format.
+        #    contact_name - Optional field that has the name of the contact.
+
+        self._address = attrib["number"]
+        self._duration = int(attrib["duration"])
+        self._date = attrib["date"]
+        self._ctype = int(attrib["type"])
+        self._readable_date = attrib.get(
+            "readable_date",
+            time.strftime(
+                    '%d.%m.%Y %H:%M:%S',
+                    time.localtime(float(self._date) / 1000)))
+        self._contact_name = attrib["contact_name"]
+
+        self.contact = self._contact_name
+        if self.contact == '(Unknown)':
+            self.contact = self._address
+
+    def get_type_text(self):
+        return [
+            "Eingehend", "Ausgehend", "Verpasst",
+            "Voicemail", "Abgelehnt", "Geblockt"][self._ctype - 1]
+
+    def is_received(self):
+        """incoming call"""
+        return self._ctype == 1
+
+    def is_sent(self):
+        """outgoing call"""
+        return self._ctype == 2
+
+    def get_contact(self):
+        return self.contact
+
+    def get_contact_with_number(self):
+        if self._contact_name == '(Unknown)':
+            return self.contact
+        else:
+            return "%s (%s)" % (self.contact, self._address)
+
+    def get_address(self):
+        return self._address
+
+    def get_date(self):
+        return self._readable_date
+
+    def get_timestamp(self):
+        """Java date, i.e. milliseconds since the epoch."""
+        return int(self._date)
+
+    def get_text(self):
+        m, s = divmod(self._duration, 60)
+        return "Anruf am %s: %02imin %02is, %s, %s" % (
+                self.get_date(), m, s,
+                self.get_type_text(),  self.get_contact_with_number())
+
+    def has_data(self):
+        return False
+
+    def has_multi_addresses(self):
+        return False
+
+
+class Message:
+    def __init__(self, attrib):
+        """Creates an SMS message data set. *attrib* is the attribute dict
+        returned by the xml reader.
+
+        """
+
+        # from here: https://synctech.com.au/sms-backup-restore/fields-in-xml-backup-files/
+        #
+        #    protocol - Protocol used by the message, its mostly 0 in case of SMS messages.
+        #    address - The phone number of the sender/recipient.
+        #    date - The Java date representation (including millisecond) of the time when the message was sent/received. Check out www.epochconverter.com for information on how to do the conversion from other languages to Java.
+        #    type - 1 = Received, 2 = Sent, 3 = Draft, 4 = Outbox, 5 = Failed, 6 = Queued
+        #    subject - Subject of the message, its always null in case of SMS messages.
+        #    body - The content of the message.
+        #    toa - n/a, defaults to null.
+        #    sc_toa - n/a, defaults to null.
+        #    service_center - The service center for the received message, null in case of sent messages.
+        #    read - Read Message = 1, Unread Message = 0.
+        #    status - None = -1, Complete = 0, Pending = 32, Failed = 64.
+        #    readable_date - Optional field that has the date in a human readable format.
+        #    contact_name - Optional field that has the name of the contact.
+        #    All the field values are read as is from the underlying database and no conversion is done by the app in most cases.
+        self._address = attrib["address"]
+        self._date = attrib["date"]
+        self._stype = int(attrib["type"])
+        self._text = attrib["body"]
+        self._readable_date = attrib.get(
+                "readable_date",
+                time.strftime(
+                        '%d.%m.%Y %H:%M:%S',
+                        time.localtime(float(self._date) / 1000)))
+        self._contact_name = attrib["contact_name"]
+
+        self.contact = self._contact_name
+        if self.contact == '(Unknown)':
+            self.contact = self._address
+
+    def is_received(self):
+        """message was received"""
+        return self._stype == 1
+
+    def is_sent(self):
+        """message was sent"""
+        return self._stype == 2
+
+    def is_neither_sent_nor_received(self):
+        """message is a draft, outbox, failed or queued."""
+        return self._stype != 1 and self._stype != 2
+
+    def get_type_text(self):
+        return [
+            "Empfangen", "Gesendet", "Entwurf",
+            "Ausgang", "Fehler", "Queue"][self._stype - 1]
+
+    def get_contact(self):
+        return self.contact
+
+    def get_contact_with_number(self):
+        if self._contact_name == '(Unknown)':
+            return self.contact
+        else:
+            return "%s (%s)" % (self.contact, self._address)
+
+    def get_address(self):
+        return self._address
+
+    def get_date(self):
+        return self._readable_date
+
+    def get_timestamp(self):
+        """Java date, i.e. milliseconds since the epoch."""
+        return int(self._date)
+
+    def get_text(self):
+        return self._text
+
+    def has_data(self):
+        return False
+
+    def has_multi_addresses(self):
+        return False
+
+class MMS(Message):
+    address_types={
+            129 : "BCC",
+            130 : "CC",
+            151 : "To",
+            137 : "From"}
+
+    def __init__(self, attrib):
+        """Creates an MMS message data set. *attrib* is the attribute dict
+        returned by the xml reader. parts and addrs must be added with
+        the appropiate methods.
+
+        """
+
+        # from here: https://synctech.com.au/sms-backup-restore/fields-in-xml-backup-files/
+        #
+        # An MMS message comprises of a few different elements with a structure like this:
+        # <mms>
+        #    <parts>
+        #       <part/>
+        #       <part/>
+        #   </parts>
+        #   <addrs>
+        #       <addr/>
+        #       <addr/>
+        #   </addr>
+        # </mms>
+        #
+        # The mms element contains most of the metadata about the message like the phone numbers, date/time etc.
+        # The part elements contain the actual content of the message like a photo or video or the text message.
+        # The addr elements contain the list of recipients of the messages in case of group messages.
+        # The actual attributes in the elements vary depending on the phone but here are some of the common attributes:
+        #     mms
+        #         date - The Java date representation (including millisecond) of the time when the message was sent/received. Check out www.epochconverter.com for information on how to do the conversion from other languages to Java.
+        #         ct_t - The Content-Type of the message, usually "application/vnd.wap.multipart.related"
+        #         msg_box - The type of message, 1 = Received, 2 = Sent, 3 = Draft, 4 = Outbox
+        #         rr - The read-report of the message.
+        #         sub - The subject of the message, if present.
+        #         read_status - The read-status of the message.
+        #         address - The phone number of the sender/recipient.
+        #         m_id - The Message-ID of the message
+        #         read - Has the message been read
+        #         m_size - The size of the message.
+        #         m_type - The type of the message defined by MMS spec.
+        #         readable_date - Optional field that has the date in a human readable format.
+        #         contact_name - Optional field that has the name of the contact.
+        #     part
+        #         seq - The order of the part.
+        #         ct - The content type of the part.
+        #         name - The name of the part.
+        #         chset - The charset of the part.
+        #         cl - The content location of the part.
+        #         text - The text content of the part.
+        #         data - The base64 encoded binary content of the part.
+        #     addr
+        #         address - The phone number of the sender/recipient.
+        #         type - The type of address, 129 = BCC, 130 = CC, 151 = To, 137 = From
+        #         charset - Character set of this entry
+        self._address = attrib["address"]
+        self._date = attrib["date"]
+        self._stype = int(attrib["msg_box"])
+        self._readable_date = attrib.get(
+                "readable_date",
+                time.strftime(
+                        '%d.%m.%Y %H:%M:%S',
+                        time.localtime(float(self._date) / 1000)))
+        self._contact_name = attrib["contact_name"]
+        self._text = '' # can be updated later if parts contain text
+        self._parts = []
+        self._addrs = []
+        self._num_data_blocks = 0
+        self._num_text_blocks = 0
+
+        self.contact = self._contact_name
+        if self.contact == '(Unknown)':
+            self.contact = self._address
+
+    # DONE with parts:
+    # if ct is application/smil, just skip it (hope this is not too risky to miss something important)
+    # if ct is text/plain, add the text as message
+    # otherwise, if there is text != 'null', same as above. (should maybe never be, but who knows, I don't want something to fall under the table)
+    #    also otherwise, if there is data, save it as base64bytes for later
+    #    also save 'name' field, could be file name.
+    #    also save content type, because if image we can show it later
+    #       Put these three together as dict in a list
+    #
+    # Then later, when message is shown:
+    # Show all parts, i.e.
+    #    all texts if any
+    #    and all images (we know it from content type)
+    #    and note when there were other files with filename. Say the file can be created when messages are saved
+    #      maybe allow saving this file if clicked on file name?
+    #      For these files, create a filename including date and contact
+
+    def add_part(self, attrib):
+        content_type = attrib["ct"]
+        if content_type == "application/smil":
+            # ignore this for now. Is attached as kind of header to every mms data:
+            return
+        elif content_type == "text/plain":
+            if not self._text:
+                self._text = attrib["text"]
+            else:
+                # there is already some text, add the new text
+                # after some newlines:
+                self._text = "\n\n".join([self._text, attrib["text"]])
+        else:
+            if "text" in attrib and attrib["text"] != "null":
+                # some other kind of text which is not 'text/plain'
+                if not self._text:
+                    self._text = attrib["text"]
+                else:
+                    # there is already some text, add the new text
+                    # after some newlines:
+                    self._text = "\n\n".join([self._text, attrib["text"]])
+            if "data" in attrib and attrib["data"] != "null":
+                filename = attrib["name"]
+                timestr = time.strftime(
+                        "_%Y-%m-%d_%H-%M-%S",
+                        time.localtime(float(self._date) / 1000))
+                if filename == 'null':
+                    # no filename given
+                    # very hackish: just take 'jpeg' part of e.g. 'image/jpeg':
+                    ext = content_type.partition('/')[2]
+                    # build filename from contact and time:
+                    filename = ''.join(
+                        ["MMS_", self.contact, timestr, '.', ext])
+                else:
+                    # Add contact name and time to filename, to make it unique:
+                    filename = ''.join(
+                        ["MMS_", self.contact, timestr, '_', filename])
+                base64bytes = attrib["data"].encode()
+                self._parts.append({
+                        'data': base64bytes,
+                        'name': filename,
+                        'ctype': content_type})
+
+    # TODO with addrs:
+    # if there are multiple senders, print them
+    # (if only one, assume it is the same as contact and ignore)
+    # if there are multiple recepients, print them
+    # (if only one, assume it is the same as receiver and ignore)
+    def add_addr(self, attrib):
+        self._addrs.append(
+            (attrib['address'], self.address_types[int(attrib['type'])]))
+
+    def has_data(self):
+        return bool(self._parts)
+
+    def has_multi_addresses(self):
+        return len(self._addrs) > 2
+
+    def get_data(self):
+        return self._parts
+
+    def get_addresses(self):
+        return self._addrs
+
+    def get_own_address(self):
+        """Return the normalised own address if this message is sent and
+        its 'From' address is a real number, otherwise None.
+
+        """
+        if not self.is_sent():
+            return None
+        for address, atype in self._addrs:
+            address = normalise_address(address)
+            if atype == "From" and address != INSERT_ADDRESS_TOKEN:
+                return address
+        return None
+
+    def get_participants(self, own_addresses=()):
+        """Return the normalised set of all addresses taking part in this
+        message, except the own one. It can be used as a key to the group
+        conversation. *own_addresses* are the user's own normalised numbers,
+        if known.
+
+        """
+        # the other participants, separated by '~':
+        others = set(
+            normalise_address(a) for a in self._address.split('~'))
+        participants = set()
+        for address, atype in self._addrs:
+            address = normalise_address(address)
+            if address == INSERT_ADDRESS_TOKEN or address in own_addresses:
+                continue
+            if self.is_sent() and atype == "From":
+                # that's us
+                continue
+            if (self.is_received() and atype != "From" and
+                    len(others) > 1 and address not in others):
+                # one of the recipients is us
+                continue
+            participants.add(address)
+        return frozenset(participants)
+
+    def get_address_names(self):
+        """Return list of (normalised address, contact name) tuples, if the
+        names of all addresses are known.
+
+        """
+        addresses = self._address.split('~')
+        names = self._contact_name.split(', ')
+        if self._contact_name == '(Unknown)' or len(names) != len(addresses):
+            return []
+        return [(normalise_address(a), n) for a, n in zip(addresses, names)]
+
+class XML_Target:
+    """The target class for the xml parser.
+    Receives calls from the XML parser with which it builds a dict
+    of SMSDataSet objects. The main dict's keys will be
+    conversations partner and the items are lists of SMSDataSet objects.
+
+    """
+    def __init__(self, types=None, contacts=None, since=None, until=None):
+        """Optionally, only a selection of the records is collected:
+        *types* is a collection of the record types to keep ('sms', 'mms'
+        and/or 'call'), *contacts* a collection of contact names or phone
+        numbers (an mms matches if any of its addresses matches), *since*
+        and *until* limit the date range (given as seconds since the epoch,
+        as datetime objects or as date objects, meaning midnight local time
+        at the start of that day). Records that do not match are skipped
+        before any data set is created, including the parts and addrs of
+        skipped mms.
+
+        """
+        self._data = {"__all__": []} # data collector
+        # mms with multiple addresses, filed by participants in get_groups:
+        self._group_messages = []
+        # normalised own addresses, found in sent mms:
+        self._own_addresses = set()
+        # contact names of the normalised addresses:
+        self._address_names = {}
+        # the mms currently being parsed, None if it is skipped:
+        self._current_mms = None
+        for name, value in (('types', types), ('contacts', contacts)):
+            if isinstance(value, str):
+                raise TypeError(
+                    "'%s' must be a collection of strings, not a string"
+                    % name)
+        if types is not None and not set(types) <= set(RECORD_TYPES):
+            raise ValueError(
+                "unknown record types %s, must be any of %s" % (
+                    sorted(set(types) - set(RECORD_TYPES)), RECORD_TYPES))
+        self._types = set(types) if types is not None else None
+        self._contacts = set(contacts) if contacts is not None else None
+        # contacts given as phone number might be formatted differently:
+        self._contact_numbers = None
+        if contacts is not None:
+            self._contact_numbers = set(
+                normalise_address(c) for c in contacts)
+        # dates in the xml are in milliseconds:
+        self._since = self._to_java_date(since)
+        self._until = self._to_java_date(until)
+        # True while inside an mms that has been filtered out:
+        self._skipping = False
+
+    @staticmethod
+    def _to_java_date(t):
+        if t is None:
+            return None
+        if hasattr(t, 'timestamp'):
+            # datetime object
+            t = t.timestamp()
+        elif hasattr(t, 'timetuple'):
+            # date object, take midnight in local time
+            t = time.mktime(t.timetuple())
+        return float(t) * 1000
+
+    def _accept(self, tag, attrib):
+        """Check if the record with the given *tag* and *attrib* matches the
+        selection, without creating a data set for it.
+
+        """
+        if self._types is not None and tag not in self._types:
+            return False
+        if self._since is not None or self._until is not None:
+            date = float(attrib["date"])
+            if self._since is not None and date < self._since:
+                return False
+            if self._until is not None and date > self._until:
+                return False
+        if self._contacts is not None:
+            # mms to groups have all addresses separated by '~' and all
+            # names separated by ', ':
+            name = attrib["contact_name"]
+            if name in self._contacts:
+                return True
+            if tag == 'mms' and not self._contacts.isdisjoint(
+                    name.split(', ')):
+                return True
+            addresses = attrib["number" if tag == 'call' else "address"]
+            return not self._contact_numbers.isdisjoint(
+                normalise_address(a) for a in addresses.split('~'))
+        return True
+
+    def start(self, tag, attrib):
+        """Called for each opening tag."""
+        if tag in RECORD_TYPES and not self._accept(tag, attrib):
+            if tag == 'mms':
+                # also skip all parts and addrs of this mms:
+                self._skipping = True
+            return
+        if self._skipping:
+            # part, addr, parts or addrs of a skipped mms
+            return
+        if tag == 'sms':
+            data = Message(attrib)
+            if data.get_contact() != data.get_address():
+                self._address_names[
+                    normalise_address(data.get_address())] = data.get_contact()
+            key = data.get_contact()
+            if not key in self._data:
+                self._data[key] = []
+            self._data[key].append(data)
+            self._data['__all__'].append(data)
+        elif tag == 'mms':
+            data = MMS(attrib)
+            key = data.get_contact()
+            if not key in self._data:
+                self._data[key] = []
+            self._data[key].append(data)
+            self._data['__all__'].append(data)
+            self._current_mms = data
+        elif tag == "part":
+            self._data['__all__'][-1].add_part(attrib)
+        elif tag == "addr":
+            self._data['__all__'][-1].add_addr(attrib)
+        elif tag == 'parts' or tag == 'addrs':
+            if attrib:
+                print(tag, attrib, "should actually be empty")
+        elif tag == 'call':
+            data = Call(attrib)
+            if data.get_contact() != data.get_address():
+                self._address_names[
+                    normalise_address(data.get_address())] = data.get_contact()
+            key = data.get_contact()
+            if not key in self._data:
+                self._data[key] = []
+            self._data[key].append(data)
+            self._data['__all__'].append(data)
+        else:
+            # at least print the unprocessed tags:
+            print(tag, attrib)
+
+    def end(self, tag):
+        """Called for each closing tag. """
+        if tag == 'mms':
+            self._skipping = False
+            # now that all addrs are known:
+            if self._current_mms is not None:
+                own = self._current_mms.get_own_address()
+                if own is not None:
+                    self._own_addresses.add(own)
+                self._address_names.update(
+                    self._current_mms.get_address_names())
+                if self._current_mms.has_multi_addresses():
+                    self._group_messages.append(self._current_mms)
+            self._current_mms = None
+            # create new pointers pointing to empty lists:
+            self._last_parts = []
+            self._last_addrs = []
+
+    def data(self, data):
+        """Called for each encountered text data."""
+        # There shouldn't be any data in the xml (no "text")
+        pass
+
+    def close(self):
+        """Return the dict. Can be called when all data has been parsed."""
+        return self._data
+
+    def get_groups(self):
+        """Return the dict of group conversations. Its keys are frozensets
+        of the normalised participants' addresses, without the own ones.
+        Can be called when all data has been parsed, when all own addresses
+        are known.
+
+        """
+        groups = {}
+        for message in self._group_messages:
+            key = message.get_participants(self._own_addresses)
+            if len(key) < 2:
+                # conversation with a single contact
+                continue
+            if not key in groups:
+                groups[key] = []
+            groups[key].append(message)
+        return groups
+
+    def get_address_names(self):
+        """Return dict of the contact names of all normalised addresses
+        with known names.
+
+        """
+        return self._address_names
+
+class Reader:
+    def __init__(
+            self, filename, types=None, contacts=None, since=None, until=None):
+        """Read and parse an xml file exported from SMS Backup and Restore App.
+
+        Optionally, only load a selection of the records: *types* is a
+        collection of record types ('sms', 'mms', 'call'), *contacts* a
+        collection of contact names or phone numbers and *since*/*until*
+        limit the date range (seconds since the epoch, datetime or date
+        objects, the latter meaning midnight at the start of that day).
+        Records outside the selection are skipped while parsing.
+
+        """
+        self.filename = filename
+        self.messages = {}
+        self.contacts = []
+        self.groups = {}
+        self.group_keys = []
+        self.address_names = {}
+
+        # regex to find and filter surrogate-coded UTF-16 emojis:
+        # these are not allowed in xml, so must be translated manually
+        regex = re.compile("&#(\d{5});&#(\d{5});")
+
+        # Expects a match of the pattern in `regex`, with two groups.
+        # returns the two utf-16 (surrogate) codes translated to proper
+        # unicode codes:
+        def repl(match):
+            g = match.groups()
+            pair = chr(int(g[0])), chr(int(g[1]))
+            return "".join(pair).encode(
+                        'utf-16', 'surrogatepass').decode('utf-16')
+
+        # the xml parser's target:
+        target = XML_Target(
+            types=types, contacts=contacts, since=since, until=until)
+        # the xml parser:
+        parser = XMLParser(target=target)
+        with open(self.filename, "r", encoding="utf-8") as f:
+            for line in f:
+                corrected_line = regex.sub(repl, line)
+                parser.feed(corrected_line)
+
+        self.messages = parser.close()
+        # sort by date. This is neccessary because mms items always come
+        # after the sms items in the xml:
+        for key, msglist in self.messages.items():
+            self.messages[key] = sorted(
+                    msglist, key=lambda s: s._date)
+        self.contacts = sorted(
+            self.messages.keys(), key=lambda s: s.casefold())
+        self.contacts.remove('__all__')
+
+        self.address_names = target.get_address_names()
+        self.groups = {
+            key: sorted(msglist, key=lambda s: s._date)
+            for key, msglist in target.get_groups().items()}
+        self.group_keys = sorted(
+            self.groups.keys(), key=self.get_group_name)
+
+    def get_all_messages(self):
+        return self.messages['__all__']
+
+    def get_message_list(self, contact):
+        return self.messages[contact]
+
+    def get_contacts_list(self):
+        return self.contacts
+
+    def get_group_threads(self):
+        """Return dict of group conversations: keys are frozensets of the
+        participants' normalised addresses (without the own ones), items
+        are the lists of messages, sorted by date.
+
+        """
+        return self.groups
+
+    def get_group_list(self):
+        """Return the keys of all group conversations, sorted by name."""
+        return self.group_keys
+
+    def get_group_name(self, key):
+        """Return the participants' contact names (or numbers, if unknown) of
+        the group conversation *key*.
+
+        """
+        return ", ".join(sorted(
+            (self.address_names.get(a, a) for a in key),
+            key=lambda s: s.casefold()))
@@ -6,10 +6,13 @@ Created on Sun Apr 12 10:09:11 2020
 @author: Jürgen Probst
 """
 
-import os, re, base64, time #, io
+import os, base64 #, io
+from collections import OrderedDict
 import tkinter as tk
 from tkinter import filedialog
-from xml.etree.ElementTree import XMLParser
+from tkinter import font as tkfont
+
+from SMS_Backup_Parser import normalise_address, Call, Reader
 
 try:
     from PIL import ImageTk
@@ -17,436 +20,213 @@ except ModuleNotFoundError:
     ImageTk = False
 
 
-#plan:
-# - read file line by line - ok
-# - correct line on the fly - ok
-# - sent/serve corrected line to xml-parser (SAX or iterparse style) ok
-# - event is e.g. a <sms>, create a namedtuple for each entry with all data
-# - make dict: add namedtuple, keys are conversation partner, items are lists of smss
-# - also need list of conversation partners? (or use keys of dict?)
-# - another list of all smss, sorted by date (or have a special entry 'all' in dict?)
-
-class Call:
-    def __init__(self, attrib):
-        """Creates a call data set. *attrib* is the attribute dict
-        returned by the xml reader.
+class ContactIndex:
+    """Casefolded substring index over the searchable texts of the
+    contact list entries, e.g. names and phone numbers.
 
-        """
+    Every one- and two-character substring of a text is a key to the list
+    of entries containing it, so a search only needs to check the entries
+    sharing the first characters of the query. If the query contains the
+    previous one (i.e. the user keeps typing), only the previous results
+    are checked.
 
-        # from here: https://synctech.com.au/sms-backup-restore/fields-in-xml-backup-files/
-        #    number - The phone number of the call.
-        #    duration - The duration of the call in seconds.
-        #    date - The Java date representation (including millisecond) of the time when the message was sent/received. Check out www.epochconverter.com for information on how to do the conversion from other languages to Java.
-        #    type - 1 = Incoming, 2 = Outgoing, 3 = Missed, 4 = Voicemail, 5 = Rejected, 6 = Refused List.
-        #    presentation - caller id presentation info. 1 = Allowed, 2 = Restricted, 3 = Unknown, 4 = Payphone.
-        #    readable_date - Optional field that has the date in a human readable format.
-        #    contact_name - Optional field that has the name of the contact.
-
-        self._address = attrib["number"]
-        self._duration = int(attrib["duration"])
-        self._date = attrib["date"]
-        self._ctype = int(attrib["type"])
-        self._readable_date = attrib.get(
-            "readable_date",
-            time.strftime(
-                    '%d.%m.%Y %H:%M:%S',
-                    time.localtime(float(self._date) / 1000)))
-        self._contact_name = attrib["contact_name"]
-
-        self.contact = self._contact_name
-        if self.contact == '(Unknown)':
-            self.contact = self._address
-
-    def get_type_text(self):
-        return [
-            "Eingehend", "Ausgehend", "Verpasst",
-            "Voicemail", "Abgelehnt", "Geblockt"][self._ctype - 1]
-
-    def is_received(self):
-        """incoming call"""
-        return self._ctype == 1
-
-    def is_sent(self):
-        """outgoing call"""
-        return self._ctype == 2
-
-    def get_contact(self):
-        return self.contact
-
-    def get_contact_with_number(self):
-        if self._contact_name == '(Unknown)':
-            return self.contact
+    """
+    def __init__(self, texts):
+        self._texts = [t.casefold() for t in texts]
+        self._index = {}
+        for i, text in enumerate(self._texts):
+            keys = set()
+            for j in range(len(text)):
+                keys.add(text[j])
+                keys.add(text[j:j + 2])
+            for key in keys:
+                if not key in self._index:
+                    self._index[key] = []
+                self._index[key].append(i)
+        self._last_query = ''
+        self._last_result = list(range(len(self._texts)))
+
+    def search(self, query):
+        """Return the sorted indices of all texts containing *query*."""
+        query = query.casefold()
+        if not query:
+            result = list(range(len(self._texts)))
         else:
-            return "%s (%s)" % (self.contact, self._address)
-
-    def get_address(self):
-        return self._address
-
-    def get_date(self):
-        return self._readable_date
-
-    def get_text(self):
-        m, s = divmod(self._duration, 60)
-        return "Anruf am %s: %02imin %02is, %s, %s" % (
-                self.get_date(), m, s,
-                self.get_type_text(),  self.get_contact_with_number())
+            if self._last_query and self._last_query in query:
+                candidates = self._last_result
+            else:
+                candidates = self._index.get(query[:2], [])
+            result = [i for i in candidates if query in self._texts[i]]
+        self._last_query = query
+        self._last_result = result
+        return result
 
-    def has_data(self):
-        return False
 
-    def has_multi_addresses(self):
-        return False
+class VirtualListbox(tk.Listbox):
+    """A Listbox which only holds the rows currently visible, so it can be
+    filled with huge lists instantly. The scrollbar, mouse wheel and
+    navigation keys are handled here instead of by Tk.
 
+    *command* is called when the user selects an item. curselection()
+    returns the selected index in the whole list set with set_items().
 
-class Message:
-    def __init__(self, attrib):
-        """Creates an SMS message data set. *attrib* is the attribute dict
-        returned by the xml reader.
+    """
+    def __init__(self, master=None, yscrollcommand=None, command=None, **kw):
+        super().__init__(master, **kw)
+        self._yscrollcommand = yscrollcommand
+        self._command = command
+        self._items = []
+        self._top = 0 # index of first visible item
+        self._rows = 1 # number of rows shown, the last maybe partly
+        self._full_rows = 1 # number of fully visible rows
+        self._height = 0 # inner height of the listbox in pixels
+        self._selected = None
+        self._linespace = tkfont.Font(font=self.cget('font')).metrics(
+            'linespace')
+        self.bind('<Configure>', self._on_configure)
+        self.bind('<<ListboxSelect>>', self._on_select)
+        self.bind('<MouseWheel>', self._on_mousewheel)
+        self.bind('<Button-4>', self._on_mousewheel)
+        self.bind('<Button-5>', self._on_mousewheel)
+        # Tk's class bindings of these keys would only act on the rows
+        # held by the listbox:
+        self.bind('<Up>', lambda event: self._move_selection(-1))
+        self.bind('<Down>', lambda event: self._move_selection(1))
+        self.bind(
+            '<Prior>', lambda event: self._move_selection(-self._full_rows))
+        self.bind(
+            '<Next>', lambda event: self._move_selection(self._full_rows))
+        for key in ('<Home>', '<Control-Home>'):
+            self.bind(key, lambda event: self._select_index(0))
+        for key in ('<End>', '<Control-End>'):
+            self.bind(
+                key, lambda event: self._select_index(len(self._items) - 1))
+
+    def set_items(self, items, selected=None):
+        """Replace the list of items. *selected* is the index of the item to
+        highlight, or None.
 
         """
-
-        # from here: https://synctech.com.au/sms-backup-restore/fields-in-xml-backup-files/
-        #
-        #    protocol - Protocol used by the message, its mostly 0 in case of SMS messages.
-        #    address - The phone number of the sender/recipient.
-        #    date - The Java date representation (including millisecond) of the time when the message was sent/received. Check out www.epochconverter.com for information on how to do the conversion from other languages to Java.
-        #    type - 1 = Received, 2 = Sent, 3 = Draft, 4 = Outbox, 5 = Failed, 6 = Queued
-        #    subject - Subject of the message, its always null in case of SMS messages.
-        #    body - The content of the message.
-        #    toa - n/a, defaults to null.
-        #    sc_toa - n/a, defaults to null.
-        #    service_center - The service center for the received message, null in case of sent messages.
-        #    read - Read Message = 1, Unread Message = 0.
-        #    status - None = -1, Complete = 0, Pending = 32, Failed = 64.
-        #    readable_date - Optional field that has the date in a human readable format.
-        #    contact_name - Optional field that has the name of the contact.
-        #    All the field values are read as is from the underlying database and no conversion is done by the app in most cases.
-        self._address = attrib["address"]
-        self._date = attrib["date"]
-        self._stype = int(attrib["type"])
-        self._text = attrib["body"]
-        self._readable_date = attrib.get(
-                "readable_date",
-                time.strftime(
-                        '%d.%m.%Y %H:%M:%S',
-                        time.localtime(float(self._date) / 1000)))
-        self._contact_name = attrib["contact_name"]
-
-        self.contact = self._contact_name
-        if self.contact == '(Unknown)':
-            self.contact = self._address
-
-    def is_received(self):
-        """message was received"""
-        return self._stype == 1
-
-    def is_sent(self):
-        """message was sent"""
-        return self._stype == 2
-
-    def is_neither_sent_nor_received(self):
-        """message is a draft, outbox, failed or queued."""
-        return self._stype != 1 and self._stype != 2
-
-    def get_type_text(self):
-        return [
-            "Empfangen", "Gesendet", "Entwurf",
-            "Ausgang", "Fehler", "Queue"][self._stype - 1]
-
-    def get_contact(self):
-        return self.contact
-
-    def get_contact_with_number(self):
-        if self._contact_name == '(Unknown)':
-            return self.contact
-        else:
-            return "%s (%s)" % (self.contact, self._address)
-
-    def get_address(self):
-        return self._address
-
-    def get_date(self):
-        return self._readable_date
-
-    def get_text(self):
-        return self._text
-
-    def has_data(self):
-        return False
-
-    def has_multi_addresses(self):
-        return False
-
-class MMS(Message):
-    address_types={
-            129 : "BCC",
-            130 : "CC",
-            151 : "To",
-            137 : "From"}
-
-    def __init__(self, attrib):
-        """Creates an MMS message data set. *attrib* is the attribute dict
-        returned by the xml reader. parts and addrs must be added with
-        the appropiate methods.
+        self._items = items
+        self._selected = selected
+        self._top = 0
+        if selected is not None and selected >= self._full_rows:
+            self._top = selected - self._full_rows // 2
+        self._refresh()
+
+    def curselection(self):
+        if self._selected is None:
+            return ()
+        return (self._selected,)
+
+    def yview(self, *args):
+        if not args:
+            return self._get_fractions()
+        if args[0] == 'moveto':
+            self._top = int(float(args[1]) * len(self._items))
+        elif args[0] == 'scroll':
+            if args[2] == 'pages':
+                self._top += int(args[1]) * self._full_rows
+            else:
+                self._top += int(args[1])
+        self._refresh()
+
+    def _get_fractions(self):
+        if not self._items:
+            return 0.0, 1.0
+        n = len(self._items)
+        return self._top / n, min(1.0, (self._top + self._full_rows) / n)
+
+    def _refresh(self):
+        self._top = max(0, min(self._top, len(self._items) - self._full_rows))
+        self.delete(0, tk.END)
+        visible = self._items[self._top:self._top + self._rows]
+        if visible:
+            self.insert(tk.END, *visible)
+        if (self._selected is not None and
+                self._top <= self._selected < self._top + self._rows):
+            self.selection_set(self._selected - self._top)
+        if self._yscrollcommand:
+            self._yscrollcommand(*self._get_fractions())
+
+    def _get_row_height(self):
+        """Return the height of a row in pixels, measured from the shown
+        rows if possible.
 
         """
+        if self.size() >= 2:
+            first, second = self.bbox(0), self.bbox(1)
+            if first and second and second[1] > first[1]:
+                return second[1] - first[1]
+        # this is how Tk computes it:
+        return self._linespace + 1 + 2 * int(self.cget('selectborderwidth'))
 
-        # from here: https://synctech.com.au/sms-backup-restore/fields-in-xml-backup-files/
-        #
-        # An MMS message comprises of a few different elements with a structure like this:
-        # <mms>
-        #    <parts>
-        #       <part/>
-        #       <part/>
-        #   </parts>
-        #   <addrs>
-        #       <addr/>
-        #       <addr/>
-        #   </addr>
-        # </mms>
-        #
-        # The mms element contains most of the metadata about the message like the phone numbers, date/time etc.
-        # The part elements contain the actual content of the message like a photo or video or the text message.
-        # The addr elements contain the list of recipients of the messages in case of group messages.
-        # The actual attributes in the elements vary depending on the phone but here are some of the common attributes:
-        #     mms
-        #         date - The Java date representation (including millisecond) of the time when the message was sent/received. Check out www.epochconverter.com for information on how to do the conversion from other languages to Java.
-        #         ct_t - The Content-Type of the message, usually "application/vnd.wap.multipart.related"
-        #         msg_box - The type of message, 1 = Received, 2 = Sent, 3 = Draft, 4 = Outbox
-        #         rr - The read-report of the message.
-        #         sub - The subject of the message, if present.
-        #         read_status - The read-status of the message.
-        #         address - The phone number of the sender/recipient.
-        #         m_id - The Message-ID of the message
-        #         read - Has the message been read
-        #         m_size - The size of the message.
-        #         m_type - The type of the message defined by MMS spec.
-        #         readable_date - Optional field that has the date in a human readable format.
-        #         contact_name - Optional field that has the name of the contact.
-        #     part
-        #         seq - The order of the part.
-        #         ct - The content type of the part.
-        #         name - The name of the part.
-        #         chset - The charset of the part.
-        #         cl - The content location of the part.
-        #         text - The text content of the part.
-        #         data - The base64 encoded binary content of the part.
-        #     addr
-        #         address - The phone number of the sender/recipient.
-        #         type - The type of address, 129 = BCC, 130 = CC, 151 = To, 137 = From
-        #         charset - Character set of this entry
-        self._address = attrib["address"]
-        self._date = attrib["date"]
-        self._stype = int(attrib["msg_box"])
-        self._readable_date = attrib.get(
-                "readable_date",
-                time.strftime(
-                        '%d.%m.%Y %H:%M:%S',
-                        time.localtime(float(self._date) / 1000)))
-        self._contact_name = attrib["contact_name"]
-        self._text = '' # can be updated later if parts contain text
-        self._parts = []
-        self._addrs = []
-        self._num_data_blocks = 0
-        self._num_text_blocks = 0
-
-        self.contact = self._contact_name
-        if self.contact == '(Unknown)':
-            self.contact = self._address
-
-    # DONE with parts:
-    # if ct is application/smil, just skip it (hope this is not too risky to miss something important)
-    # if ct is text/plain, add the text as message
-    # otherwise, if there is text != 'null', same as above. (should maybe never be, but who knows, I don't want something to fall under the table)
-    #    also otherwise, if there is data, save it as base64bytes for later
-    #    also save 'name' field, could be file name.
-    #    also save content type, because if image we can show it later
-    #       Put these three together as dict in a list
-    #
-    # Then later, when message is shown:
-    # Show all parts, i.e.
-    #    all texts if any
-    #    and all images (we know it from content type)
-    #    and note when there were other files with filename. Say the file can be created when messages are saved
-    #      maybe allow saving this file if clicked on file name?
-    #      For these files, create a filename including date and contact
-
-    def add_part(self, attrib):
-        content_type = attrib["ct"]
-        if content_type == "application/smil":
-            # ignore this for now. Is attached as kind of header to every mms data:
-            return
-        elif content_type == "text/plain":
-            if not self._text:
-                self._text = attrib["text"]
-            else:
-                # there is already some text, add the new text
-                # after some newlines:
-                self._text = "\n\n".join([self._text, attrib["text"]])
-        else:
-            if "text" in attrib and attrib["text"] != "null":
-                # some other kind of text which is not 'text/plain'
-                if not self._text:
-                    self._text = attrib["text"]
-                else:
-                    # there is already some text, add the new text
-                    # after some newlines:
-                    self._text = "\n\n".join([self._text, attrib["text"]])
-            if "data" in attrib and attrib["data"] != "null":
-                filename = attrib["name"]
-                timestr = time.strftime(
-                        "_%Y-%m-%d_%H-%M-%S",
-                        time.localtime(float(self._date) / 1000))
-                if filename == 'null':
-                    # no filename given
-                    # very hackish: just take 'jpeg' part of e.g. 'image/jpeg':
-                    ext = content_type.partition('/')[2]
-                    # build filename from contact and time:
-                    filename = ''.join(
-                        ["MMS_", self.contact, timestr, '.', ext])
-                else:
-                    # Add contact name and time to filename, to make it unique:
-                    filename = ''.join(
-                        ["MMS_", self.contact, timestr, '_', filename])
-                base64bytes = attrib["data"].encode()
-                self._parts.append({
-                        'data': base64bytes,
-                        'name': filename,
-                        'ctype': content_type})
-
-    # TODO with addrs:
-    # if there are multiple senders, print them
-    # (if only one, assume it is the same as contact and ignore)
-    # if there are multiple recepients, print them
-    # (if only one, assume it is the same as receiver and ignore)
-    def add_addr(self, attrib):
-        self._addrs.append(
-            (attrib['address'], self.address_types[int(attrib['type'])]))
-
-    def has_data(self):
-        return bool(self._parts)
-
-    def has_multi_addresses(self):
-        return len(self._addrs) > 2
-
-    def get_data(self):
-        return self._parts
-
-    def get_addresses(self):
-        return self._addrs
-
-class XML_Target:
-    """The target class for the xml parser.
-    Receives calls from the XML parser with which it builds a dict
-    of SMSDataSet objects. The main dict's keys will be
-    conversations partner and the items are lists of SMSDataSet objects.
+    def _update_rows(self):
+        """Compute the number of rows fitting into the listbox. Returns True
+        if it changed.
 
-    """
-    def __init__(self):
-        self._data = {"__all__": []} # data collector
-
-    def start(self, tag, attrib):
-        """Called for each opening tag."""
-        if tag == 'sms':
-            data = Message(attrib)
-            key = data.get_contact()
-            if not key in self._data:
-                self._data[key] = []
-            self._data[key].append(data)
-            self._data['__all__'].append(data)
-        elif tag == 'mms':
-            data = MMS(attrib)
-            key = data.get_contact()
-            if not key in self._data:
-                self._data[key] = []
-            self._data[key].append(data)
-            self._data['__all__'].append(data)
-        elif tag == "part":
-            self._data['__all__'][-1].add_part(attrib)
-        elif tag == "addr":
-            self._data['__all__'][-1].add_addr(attrib)
-        elif tag == 'parts' or tag == 'addrs':
-            if attrib:
-                print(tag, attrib, "should actually be empty")
-        elif tag == 'call':
-            data = Call(attrib)
-            key = data.get_contact()
-            if not key in self._data:
-                self._data[key] = []
-            self._data[key].append(data)
-            self._data['__all__'].append(data)
+        """
+        row_height = self._get_row_height()
+        full_rows = max(1, self._height // row_height)
+        # the last row might only be partly visible:
+        rows = full_rows + (1 if self._height % row_height else 0)
+        if rows == self._rows and full_rows == self._full_rows:
+            return False
+        self._rows, self._full_rows = rows, full_rows
+        return True
+
+    def _on_configure(self, event):
+        inset = (int(self.cget('borderwidth')) +
+                 int(self.cget('highlightthickness')))
+        self._height = event.height - 2 * inset
+        if self._update_rows():
+            self._refresh()
+            # now the rows can be measured from the widget:
+            if self._update_rows():
+                self._refresh()
+
+    def _on_select(self, event):
+        selection = super().curselection()
+        if selection:
+            self._selected = self._top + selection[0]
+            if self._command:
+                self._command(event)
+
+    def _on_mousewheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            self.yview('scroll', -3, 'units')
         else:
-            # at least print the unprocessed tags:
-            print(tag, attrib)
-
-    def end(self, tag):
-        """Called for each closing tag. """
-        if tag == 'mms':
-            # create new pointers pointing to empty lists:
-            self._last_parts = []
-            self._last_addrs = []
+            self.yview('scroll', 3, 'units')
+        return 'break'
 
-    def data(self, data):
-        """Called for each encountered text data."""
-        # There shouldn't be any data in the xml (no "text")
-        pass
+    def _move_selection(self, step):
+        if self._selected is None:
+            return self._select_index(self._top)
+        return self._select_index(self._selected + step)
 
-    def close(self):
-        """Return the dict. Can be called when all data has been parsed."""
-        return self._data
-
-class Reader:
-    def __init__(self, filename):
-        """Read and parse an xml file exported from SMS Backup and Restore App.
+    def _select_index(self, index):
+        """Select the item *index*, scroll it into view and call the
+        command.
 
         """
-        self.filename = filename
-        self.messages = {}
-        self.contacts = []
-
-        # regex to find and filter surrogate-coded UTF-16 emojis:
-        # these are not allowed in xml, so must be translated manually
-        regex = re.compile("&#(\d{5});&#(\d{5});")
-
-        # Expects a match of the pattern in `regex`, with two groups.
-        # returns the two utf-16 (surrogate) codes translated to proper
-        # unicode codes:
-        def repl(match):
-            g = match.groups()
-            pair = chr(int(g[0])), chr(int(g[1]))
-            return "".join(pair).encode(
-                        'utf-16', 'surrogatepass').decode('utf-16')
-
-        # the xml parser's target:
-        target = XML_Target()
-        # the xml parser:
-        parser = XMLParser(target=target)
-        with open(self.filename, "r", encoding="utf-8") as f:
-            for line in f:
-                corrected_line = regex.sub(repl, line)
-                parser.feed(corrected_line)
-
-        self.messages = parser.close()
-        # sort by date. This is neccessary because mms items always come
-        # after the sms items in the xml:
-        for key, msglist in self.messages.items():
-            self.messages[key] = sorted(
-                    msglist, key=lambda s: s._date)
-        self.contacts = sorted(
-            self.messages.keys(), key=lambda s: s.casefold())
-        self.contacts.remove('__all__')
-
-    def get_all_messages(self):
-        return self.messages['__all__']
-
-    def get_message_list(self, contact):
-        return self.messages[contact]
-
-    def get_contacts_list(self):
-        return self.contacts
+        if not self._items:
+            return 'break'
+        self._selected = max(0, min(index, len(self._items) - 1))
+        if self._selected < self._top:
+            self._top = self._selected
+        elif self._selected >= self._top + self._full_rows:
+            self._top = self._selected - self._full_rows + 1
+        self._refresh()
+        if self._command:
+            self._command(None)
+        return 'break'
 
 
 class Application(tk.Frame):
+    # estimated size of the rendered conversations kept for fast
+    # switching, counted in characters of text plus pixels of images:
+    RENDER_CACHE_LIMIT = 20000000
+
     def __init__(self, master=None):
         super().__init__(master)
         self.master = master
@@ -470,22 +250,35 @@ class Application(tk.Frame):
 
         # listbox
         frame = tk.Frame(mainframe)
+        filterframe = tk.Frame(frame)
+        filterframe.pack(side=tk.TOP, fill=tk.X)
+        tk.Label(filterframe, text="Filter:").pack(side=tk.LEFT)
+        self.filter_var = tk.StringVar()
+        self.filter_var.trace_add('write', self.filter_contacts)
+        tk.Entry(
+            filterframe, textvariable=self.filter_var,
+            background='gray90').pack(side=tk.LEFT, fill=tk.X, expand=1)
         scrollbar = tk.Scrollbar(frame, orient=tk.VERTICAL)
-        self.listedt = tk.Listbox(
+        self.listedt = VirtualListbox(
             frame,
             selectmode=tk.BROWSE,
             exportselection=0,
             yscrollcommand=scrollbar.set,
+            command=self.select_contact,
             background='gray80')
         scrollbar.config(command=self.listedt.yview)
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         self.listedt.pack(side=tk.LEFT, fill=tk.BOTH, expand=1)
-        #self.listedt.bind("<ButtonRelease-1>", self.select_contact)
-        #self.listedt.bind("<space>", self.select_contact)
-        #self.listedt.bind("<Return>", self.select_contact)
-        self.listedt.bind("<<ListboxSelect>>", self.select_contact)
         mainframe.add(frame)
 
+        # entries of the listbox, as tuples (label, kind, key), where
+        # kind is 'all', 'contact' or 'group':
+        self._list_entries = []
+        # indices into self._list_entries of the currently listed entries:
+        self._listed = []
+        self._contact_index = None
+        self._selected_entry = None
+
         # text
         frame = tk.Frame(mainframe)
         self.savebtn = tk.Button(
@@ -508,9 +301,50 @@ class Application(tk.Frame):
         self.textedt.pack(side=tk.LEFT, fill=tk.BOTH, expand=1)
         mainframe.add(frame)
 
-    def insert_text_to_textedit(self, text, tag):
-        """Adds text to tkinter Text. If 'text' contains unallowed signs,
-        like emojis, replace them with replacement sign.
+        self.textedt.tag_config(
+            "received", background="light blue", rmargin=40,
+            justify=tk.LEFT)
+        self.textedt.tag_config(
+            "sent", background="pale green", lmargin1=40, lmargin2=40,
+            justify=tk.RIGHT)
+        self.textedt.tag_config(
+            "other", background="light pink", lmargin1=40, lmargin2=40,
+            justify=tk.RIGHT)
+        self.textedt.tag_config(
+            "grayed",
+            foreground='gray')
+        self.textedt.tag_config(
+            "offset", offset=10) # extra spacing below text
+        self.textedt.tag_config(
+            "link", underline=1)
+        self.textedt.tag_bind(
+            "link", "<Enter>", self.show_hand_cursor)
+        self.textedt.tag_bind(
+            "link", "<Leave>", self.hide_hand_cursor)
+
+        # Check once if Tk can display characters outside the Basic
+        # Multilingual Plane, like emojis:
+        try:
+            self.textedt.insert(tk.END, chr(0x1F600))
+            self._astral_supported = True
+        except tk.TclError:
+            self._astral_supported = False
+        self.textedt.delete(1.0, tk.END)
+
+        # rendered conversations, keys are indices into self._list_entries,
+        # the most recently shown is last:
+        self._rendered = OrderedDict()
+        # sum of the estimated sizes of self._rendered:
+        self._rendered_size = 0
+        # index into self._list_entries of the shown conversation:
+        self._shown_entry = None
+        # the shown conversation, keeps a reference to its images even if
+        # it is not cached:
+        self._shown_rendered = None
+
+    def make_display_safe(self, text):
+        """Return 'text' with unallowed signs, like emojis, replaced with
+        the replacement sign, if Tk cannot display them.
 
         """
         """
@@ -533,20 +367,18 @@ class Application(tk.Frame):
         https://docs.python.org/3/library/xml.etree.elementtree.html#xmlparser-objects
 
         """
-        try:
-            self.textedt.insert(tk.END, '\n' + text + '\n\n', tag)
-        except tk.TclError:
-            pieces = ['\n']
-            copied = 0
-            for i in range(len(text)):
-                if ord(text[i]) >= 0x10000:
-                    if i > copied:
-                        pieces.append(text[copied:i])
-                    pieces.append(chr(0xFFFD)) # replacement sign
-                    copied = i + 1
-            pieces.append(text[copied:])
-            pieces.append('\n\n')
-            self.textedt.insert(tk.END, "".join(pieces), tag)
+        if self._astral_supported:
+            return text
+        pieces = []
+        copied = 0
+        for i in range(len(text)):
+            if ord(text[i]) >= 0x10000:
+                if i > copied:
+                    pieces.append(text[copied:i])
+                pieces.append(chr(0xFFFD)) # replacement sign
+                copied = i + 1
+        pieces.append(text[copied:])
+        return "".join(pieces)
 
     def show_hand_cursor(self, event):
         self.textedt.config(cursor="hand2")
@@ -563,53 +395,47 @@ class Application(tk.Frame):
                 print("saved MMS content as '%s'" % fname)
         return save_as
 
-    def select_contact(self, event):
-        selection = self.listedt.curselection()[0]
-        if selection == 0:
-            contact = '__all__'
+    def get_selected_messages(self):
+        """Return the heading and the list of messages of the conversation
+        selected in the listbox. The heading is None if all messages are
+        selected.
+
+        """
+        label, kind, key = self._list_entries[self._selected_entry]
+        if kind == 'all':
+            return None, self.reader.get_all_messages()
+        elif kind == 'contact':
+            messages = self.reader.get_message_list(key)
+            return messages[0].get_contact_with_number(), messages
         else:
-            contact = self.reader.get_contacts_list()[selection - 1]
+            return label, self.reader.get_group_threads()[key]
 
-        self.textedt.config(state=tk.NORMAL, background='gray90')
-        self.textedt.delete(1.0, tk.END)
-        self.textedt.tag_config(
-            "received", background="light blue", rmargin=40,
-            justify=tk.LEFT)
-        self.textedt.tag_config(
-            "sent", background="pale green", lmargin1=40, lmargin2=40,
-            justify=tk.RIGHT)
-        self.textedt.tag_config(
-            "other", background="light pink", lmargin1=40, lmargin2=40,
-            justify=tk.RIGHT)
-        self.textedt.tag_config(
-            "grayed",
-            foreground='gray')
-        self.textedt.tag_config(
-            "offset", offset=10) # extra spacing below text
-        self.textedt.tag_config(
-            "link", underline=1)
-        self.textedt.tag_bind(
-            "link", "<Enter>", self.show_hand_cursor)
-        self.textedt.tag_bind(
-            "link", "<Leave>", self.hide_hand_cursor)
+    def render_conversation(self, heading, messages):
+        """Format all *messages* for the Text widget. Returns a dict with
+        the 'segments' to insert: either lists of alternating text and tags,
+        which can be inserted at once, or images (as tuples 'image',
+        PhotoImage, tag, link tag). 'links' holds the (link tag, filename,
+        data) of the attachments to bind, 'top' the index of the topmost
+        visible character, to restore the scroll position, and 'size' the
+        estimated size (characters of text plus pixels of images).
+
+        """
+        safe = self.make_display_safe
+        segments = []
+        links = []
+        run = []
 
-        if contact != '__all__':
-            self.textedt.insert(
-                tk.END,
-                '%s\n\n' % (
-                    self.reader.get_message_list(
-                            contact)[0].get_contact_with_number() ))
+        def add(text, tags):
+            run.extend((text, tags))
+
+        if heading is not None:
+            add('%s\n\n' % safe(heading), ())
 
         #img = tk.PhotoImage(file="emoji.png").subsample(2)
         #img = ImageTk.PhotoImage(Image.open('emoji.png'))
         #self.textedt.image_create(tk.END, image=img)
-        # store a reference to prevent it being garbage-collected:
-        #self.textedt.img = img
-
-        # clear previous images:
-        self._current_images = []
 
-        for i, message in enumerate(self.reader.get_message_list(contact)):
+        for i, message in enumerate(messages):
             if message.is_received():
                 tag = "received"
             elif message.is_sent():
@@ -618,11 +444,12 @@ class Application(tk.Frame):
                 tag = "other"
             text = message.get_text()
             if text:
-                self.insert_text_to_textedit(text, tag)
+                add('\n' + safe(text) + '\n\n', tag)
             if message.has_data():
                 data = message.get_data()
-                self.textedt.imgs = []
                 for d in data:
+                    # use unique tagname:
+                    links.append(("link%i" % i, d['name'], d['data']))
                     if d['ctype'].startswith('image/') and ImageTk:
 
                         #iob = io.BytesIO(base64.decodebytes(d['data']))
@@ -633,52 +460,92 @@ class Application(tk.Frame):
                         # TODO: if image is too big (bigger than what?),
                         # decrease image size?
 
-                        self.textedt.insert(tk.END, '\n', tag)
-                        self.textedt.image_create(tk.END, image=img)
-
-                        # use unique tagname:
-                        self.textedt.tag_bind(
-                            "link%i" % i, "<Button-1>",
-                            self.get_saveas_event(d['name'], d['data']))
-                        self.textedt.tag_add("link", 'end-1l', 'end')
-                        self.textedt.tag_add("link%i" % i, 'end-1l', 'end')
-
-                        # store a reference to prevent it being garbage-collected:
-                        self._current_images.append(img)
+                        add('\n', tag)
+                        segments.append(run)
+                        # the segment keeps a reference to prevent the
+                        # image being garbage-collected:
+                        segments.append(('image', img, tag, "link%i" % i))
+                        run = []
                         # this tag will be written over the image:
-                        self.textedt.insert(tk.END, '\n\n', tag)
+                        add('\n\n', tag)
                     else:
                         #print(d['ctype'])
-                        # use unique tagname:
-                        self.textedt.tag_bind(
-                            "link%i" % i, "<Button-1>",
-                            self.get_saveas_event(d['name'], d['data']))
-                        self.textedt.insert(tk.END, '\nAnhang: ', tag)
-                        self.textedt.insert(
-                            tk.END, d['name'] + '\n\n',
+                        add('\nAnhang: ', tag)
+                        add(safe(d['name']) + '\n\n',
                             (tag, "link", "link%i" % i))
 
             if message.has_multi_addresses():
-                self.textedt.insert(
-                    tk.END, "Mehrere Adressen:\n", (tag, 'grayed'))
-                self.textedt.insert(
-                    tk.END,
-                    "\n".join(
+                add("Mehrere Adressen:\n", (tag, 'grayed'))
+                add("\n".join(
                         ["%s (%s)" % (a[0], a[1])
                             for a in message.get_addresses()]),
                     (tag, 'grayed'))
-                self.textedt.insert(
-                tk.END, '\n', (tag, 'grayed',))
+                add('\n', (tag, 'grayed',))
 
             if not isinstance(message, Call):
                 # calls already have these details in their text
-                self.textedt.insert(
-                    tk.END, message.get_type_text(), (tag, 'grayed', 'offset'))
-
-                self.textedt.insert(
-                    tk.END, ': %s, %s\n' % (message.get_date(), message.get_contact_with_number()),
+                add(message.get_type_text(), (tag, 'grayed', 'offset'))
+                add(': %s, %s\n' % (
+                        message.get_date(),
+                        safe(message.get_contact_with_number())),
                     (tag, 'grayed', 'offset'))
-            self.textedt.insert(tk.END, '\n')
+            add('\n', ())
+
+        segments.append(run)
+        size = 0
+        for segment in segments:
+            if isinstance(segment, tuple):
+                size += segment[1].width() * segment[1].height()
+            else:
+                # text and tags alternate:
+                size += sum(len(text) for text in segment[::2])
+        return {
+            'segments': segments, 'links': links, 'top': '1.0',
+            'size': size}
+
+    def select_contact(self, event):
+        selection = self.listedt.curselection()
+        if not selection:
+            return
+        self._selected_entry = self._listed[selection[0]]
+
+        # remember the scroll position of the previous conversation. Use
+        # the text index, not the fraction, since Tk only estimates the
+        # height of lines not yet displayed:
+        if self._shown_entry in self._rendered:
+            self._rendered[self._shown_entry]['top'] = \
+                self.textedt.index('@0,0')
+
+        if self._selected_entry in self._rendered:
+            rendered = self._rendered[self._selected_entry]
+            self._rendered.move_to_end(self._selected_entry)
+        else:
+            rendered = self.render_conversation(*self.get_selected_messages())
+            self._rendered[self._selected_entry] = rendered
+            self._rendered_size += rendered['size']
+            # drop the least recently shown; also the new one if it is too
+            # big on its own:
+            while self._rendered_size > self.RENDER_CACHE_LIMIT:
+                _, dropped = self._rendered.popitem(last=False)
+                self._rendered_size -= dropped['size']
+        self._shown_entry = self._selected_entry
+        self._shown_rendered = rendered
+
+        self.textedt.config(state=tk.NORMAL, background='gray90')
+        self.textedt.delete(1.0, tk.END)
+        for tagname, filename, data in rendered['links']:
+            self.textedt.tag_bind(
+                tagname, "<Button-1>",
+                self.get_saveas_event(filename, data))
+        for segment in rendered['segments']:
+            if isinstance(segment, tuple):
+                _, img, tag, linktag = segment
+                self.textedt.image_create(tk.END, image=img)
+                self.textedt.tag_add("link", 'end-1l', 'end')
+                self.textedt.tag_add(linktag, 'end-1l', 'end')
+            elif segment:
+                self.textedt.insert(tk.END, *segment)
+        self.textedt.yview(rendered['top'])
 
         self.textedt.config(state=tk.DISABLED)
         self.savebtn.config(state=tk.NORMAL)
@@ -694,11 +561,49 @@ class Application(tk.Frame):
     def open_file(self):
         print("Öffne Datei", self.srcfile_edt.get())
         self.reader = Reader(self.srcfile_edt.get())
-        self.listedt.delete(0, tk.END)
-        self.listedt.insert(0, 'Alle')
-        self.listedt.insert(tk.END, *self.reader.get_contacts_list())
+        self._list_entries = [('Alle', 'all', None)]
+        # searchable texts of all entries after 'Alle':
+        texts = []
+        for contact in self.reader.get_contacts_list():
+            self._list_entries.append((contact, 'contact', contact))
+            numbers = set()
+            for message in self.reader.get_message_list(contact):
+                for address in message.get_address().split('~'):
+                    numbers.add(address)
+                    numbers.add(normalise_address(address))
+            texts.append(" ".join([contact] + sorted(numbers)))
+        for key in self.reader.get_group_list():
+            label = "Gruppe: %s" % self.reader.get_group_name(key)
+            self._list_entries.append((label, 'group', key))
+            texts.append(label)
+        self._contact_index = ContactIndex(texts)
+        self._selected_entry = None
+        self._rendered.clear()
+        self._rendered_size = 0
+        self._shown_entry = None
+        self.savebtn.config(state=tk.DISABLED)
+        self.filter_contacts()
         self.listedt.config(background='gray90')
 
+    def filter_contacts(self, *args):
+        """Show only the contacts matching the text in the filter box.
+        'Alle' is always shown.
+
+        """
+        if self._contact_index is None:
+            # no file loaded yet
+            return
+        self._listed = [0] + [
+            i + 1 for i in self._contact_index.search(self.filter_var.get())]
+        selected = None
+        if self._selected_entry is not None:
+            try:
+                selected = self._listed.index(self._selected_entry)
+            except ValueError:
+                pass
+        self.listedt.set_items(
+            [self._list_entries[i][0] for i in self._listed], selected)
+
     def save_file_dialog(self):
         fname = filedialog.asksaveasfilename(
             defaultextension='.txt',
@@ -715,12 +620,8 @@ class Application(tk.Frame):
             with open(fname, mode='w', encoding="utf-16") as f:
                 # I am using utf-16 because Windows just won't get utf-8 and
                 # I don't want to write a BOM (with utf-8-sig)
-                selection = self.listedt.curselection()[0]
-                if selection == 0:
-                    contact = '__all__'
-                else:
-                    contact = self.reader.get_contacts_list()[selection - 1]
-                for message in self.reader.get_message_list(contact):
+                heading, messages = self.get_selected_messages()
+                for message in messages:
                     if not isinstance(message, Call):
                         # calls already have these details in their text
                         f.write(message.get_type_text())
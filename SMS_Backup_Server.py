@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Headless, read-only JSON API over a backup file loaded once, so several
+tools can query the same parsed data. Serves over localhost HTTP with an
+asyncio event loop.
+
+Usage: SMS_Backup_Server.py backup.xml [--host 127.0.0.1] [--port 8000]
+
+Endpoints (all GET):
+    /contacts
+        names of all contacts and group conversations
+    /messages?contact=NAME&offset=0&limit=100
+    /messages?group=ID&offset=0&limit=100
+        messages of a contact or group conversation, paginated. Without
+        contact or group, all messages are returned.
+    /search?q=TEXT&contact=NAME&offset=0&limit=100
+        messages containing TEXT (case-insensitive), optionally only of
+        one contact
+    /attachments/MESSAGE_ID/PART
+        the decoded content of an MMS attachment, streamed
+
+"""
+
+import argparse, asyncio, base64, binascii, json, traceback
+from urllib.parse import urlsplit, parse_qs, quote
+
+from SMS_Backup_Parser import Reader, Call, MMS
+
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+# number of bytes of an attachment sent at once:
+CHUNK_SIZE = 65536
+# seconds to wait for each line of the request:
+REQUEST_TIMEOUT = 10
+
+HTTP_STATUS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    408: "Request Timeout",
+    500: "Internal Server Error"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class BackupServer:
+    def __init__(self, reader, timeout=REQUEST_TIMEOUT):
+        """Serves the messages of *reader*, a loaded Reader instance.
+        Clients are disconnected if they take longer than *timeout*
+        seconds to send a line of their request.
+
+        """
+        self.reader = reader
+        self.timeout = timeout
+        self._contacts = set(reader.get_contacts_list())
+        # the id of a message is its index in the list of all messages:
+        self._ids = {
+            id(message): i
+            for i, message in enumerate(reader.get_all_messages())}
+        # casefolded texts to search in, by id of the message:
+        self._search_texts = {
+            id(message): message.get_text().casefold()
+            for message in reader.get_all_messages()}
+        self._routes = {
+            "contacts": self.get_contacts,
+            "messages": self.get_messages,
+            "search": self.search,
+            "attachments": self.get_attachment}
+
+    async def start(self, host="127.0.0.1", port=8000):
+        """Start listening and return the asyncio server."""
+        return await asyncio.start_server(self.handle, host, port)
+
+    async def serve_forever(self, host="127.0.0.1", port=8000):
+        server = await self.start(host, port)
+        print("Serving on http://%s:%i/" % (host, port))
+        async with server:
+            await server.serve_forever()
+
+    async def handle(self, stream_reader, writer):
+        """Called for each client connection. Handles one request, then
+        closes the connection.
+
+        """
+        try:
+            try:
+                request_line = await asyncio.wait_for(
+                    stream_reader.readline(), self.timeout)
+                # skip headers, a GET request has no body:
+                while True:
+                    line = await asyncio.wait_for(
+                        stream_reader.readline(), self.timeout)
+                    if not line or line in (b"\r\n", b"\n"):
+                        break
+            except (ValueError, asyncio.LimitOverrunError):
+                # line longer than the stream's limit
+                raise HTTPError(400, "request line or header too long")
+            except asyncio.TimeoutError:
+                raise HTTPError(408, "no complete request received")
+            try:
+                method, target, version = request_line.decode(
+                    'latin-1').split()
+            except ValueError:
+                raise HTTPError(400, "malformed request line")
+            if method != "GET":
+                raise HTTPError(405, "only GET is supported")
+            url = urlsplit(target)
+            path = [p for p in url.path.split('/') if p]
+            if not path or path[0] not in self._routes:
+                raise HTTPError(404, "unknown path '%s'" % url.path)
+            query = {
+                k: v[0] for k, v in parse_qs(url.query).items()}
+            await self._routes[path[0]](writer, path[1:], query)
+        except HTTPError as e:
+            self.send_json(writer, {"error": e.message}, e.status)
+        except ConnectionError:
+            pass
+        except Exception:
+            traceback.print_exc()
+            self.send_json(writer, {"error": "internal server error"}, 500)
+        finally:
+            try:
+                await writer.drain()
+                writer.close()
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    def send_header(self, writer, status, content_type, length):
+        writer.write((
+            "HTTP/1.1 %i %s\r\n"
+            "Content-Type: %s\r\n"
+            "Content-Length: %i\r\n"
+            "Connection: close\r\n\r\n" % (
+                status, HTTP_STATUS[status], content_type, length)
+            ).encode('latin-1'))
+
+    def send_json(self, writer, obj, status=200):
+        body = json.dumps(obj, ensure_ascii=False).encode('utf-8')
+        self.send_header(
+            writer, status, "application/json; charset=utf-8", len(body))
+        writer.write(body)
+
+    def get_int(self, query, name, default, maximum=None):
+        try:
+            value = int(query.get(name, default))
+        except ValueError:
+            raise HTTPError(400, "'%s' must be an integer" % name)
+        if value < 0:
+            raise HTTPError(400, "'%s' must not be negative" % name)
+        if maximum is not None:
+            value = min(value, maximum)
+        return value
+
+    def get_message_list(self, query):
+        """Return the messages selected by the 'contact' or 'group'
+        parameter of *query*, or all messages.
+
+        """
+        if "contact" in query:
+            if not query["contact"] in self._contacts:
+                raise HTTPError(
+                    404, "unknown contact '%s'" % query["contact"])
+            return self.reader.get_message_list(query["contact"])
+        elif "group" in query:
+            groups = self.reader.get_group_list()
+            index = self.get_int(query, "group", 0)
+            if index >= len(groups):
+                raise HTTPError(404, "unknown group '%i'" % index)
+            return self.reader.get_group_threads()[groups[index]]
+        return self.reader.get_all_messages()
+
+    def message_to_dict(self, message):
+        msg_id = self._ids[id(message)]
+        if message.is_received():
+            direction = "received"
+        elif message.is_sent():
+            direction = "sent"
+        else:
+            direction = "other"
+        if isinstance(message, Call):
+            kind = "call"
+        elif isinstance(message, MMS):
+            kind = "mms"
+        else:
+            kind = "sms"
+        result = {
+            "id": msg_id,
+            "kind": kind,
+            "type": message.get_type_text(),
+            "direction": direction,
+            "timestamp": message.get_timestamp(),
+            "date": message.get_date(),
+            "contact": message.get_contact(),
+            "contact_with_number": message.get_contact_with_number(),
+            "address": message.get_address(),
+            "text": message.get_text()}
+        if message.has_multi_addresses():
+            result["addresses"] = [
+                {"address": a[0], "type": a[1]}
+                for a in message.get_addresses()]
+        if message.has_data():
+            result["attachments"] = [
+                {"name": d['name'],
+                 "ctype": d['ctype'],
+                 "url": "/attachments/%i/%i" % (msg_id, i)}
+                for i, d in enumerate(message.get_data())]
+        return result
+
+    def send_page(self, writer, messages, query):
+        offset = self.get_int(query, "offset", 0)
+        limit = self.get_int(query, "limit", DEFAULT_LIMIT, MAX_LIMIT)
+        self.send_json(writer, {
+            "total": len(messages),
+            "offset": offset,
+            "limit": limit,
+            "messages": [
+                self.message_to_dict(m)
+                for m in messages[offset:offset + limit]]})
+
+    async def get_contacts(self, writer, path, query):
+        groups = self.reader.get_group_list()
+        self.send_json(writer, {
+            "contacts": [
+                {"name": contact,
+                 "messages": "/messages?contact=%s" % quote(contact)}
+                for contact in self.reader.get_contacts_list()],
+            "groups": [
+                {"id": i,
+                 "name": self.reader.get_group_name(key),
+                 "messages": "/messages?group=%i" % i}
+                for i, key in enumerate(groups)]})
+
+    async def get_messages(self, writer, path, query):
+        self.send_page(writer, self.get_message_list(query), query)
+
+    async def search(self, writer, path, query):
+        text = query.get("q", "").casefold()
+        if not text:
+            raise HTTPError(400, "missing search text 'q'")
+        texts = self._search_texts
+        candidates = self.get_message_list(query)
+        # scan in a thread, not to block the other clients meanwhile:
+        messages = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: [m for m in candidates if text in texts[id(m)]])
+        self.send_page(writer, messages, query)
+
+    async def get_attachment(self, writer, path, query):
+        try:
+            msg_id, part = [int(p) for p in path]
+        except ValueError:
+            raise HTTPError(400, "expected /attachments/MESSAGE_ID/PART")
+        messages = self.reader.get_all_messages()
+        if not 0 <= msg_id < len(messages) or not messages[msg_id].has_data():
+            raise HTTPError(404, "no attachments in message %i" % msg_id)
+        data = messages[msg_id].get_data()
+        if not 0 <= part < len(data):
+            raise HTTPError(404, "no attachment %i in message %i" % (
+                part, msg_id))
+        d = data[part]
+        # decode before sending the header, so the length is right and
+        # invalid data can still be reported:
+        try:
+            content = base64.b64decode(
+                b"".join(d['data'].split()), validate=True)
+        except binascii.Error:
+            raise HTTPError(500, "attachment %i of message %i is corrupt" % (
+                part, msg_id))
+        self.send_header(writer, 200, d['ctype'], len(content))
+        for i in range(0, len(content), CHUNK_SIZE):
+            writer.write(content[i:i + CHUNK_SIZE])
+            await writer.drain()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve an xml file exported from SMS Backup and "
+                    "Restore App as read-only JSON API over HTTP.")
+    parser.add_argument("filename")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    print("Öffne Datei", args.filename)
+    server = BackupServer(Reader(args.filename))
+    try:
+        asyncio.run(server.serve_forever(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the selective loading and the group conversations of
+SMS_Backup_Parser.py.
+
+Run with: python -m unittest
+
+"""
+
+import datetime, os, tempfile, unittest
+
+from SMS_Backup_Parser import Reader
+
+
+# The own number is +49999. Anna (+49170), Bob (+49171) and Carl (+49172)
+# are in one group chat.
+BACKUP_XML = """<?xml version='1.0' encoding='UTF-8' standalone='yes' ?>
+<smses count="7">
+  <sms protocol="0" address="+49 170" date="1600000000000" type="1"
+       body="Hallo" contact_name="Anna" />
+  <sms protocol="0" address="+49222" date="1610000000000" type="2"
+       body="Wer ist da?" contact_name="(Unknown)" />
+  <mms date="1604000000000" msg_box="1" address="+49172"
+       contact_name="Carl" ct_t="application/vnd.wap.multipart.related">
+    <parts>
+      <part seq="0" ct="text/plain" name="null" text="Nur Carl" />
+    </parts>
+    <addrs>
+      <addr address="+49172" type="137" charset="106" />
+      <addr address="+49999" type="151" charset="106" />
+    </addrs>
+  </mms>
+  <mms date="1605000000000" msg_box="1" address="+49170~+49171~+49172"
+       contact_name="Anna, Bob, Carl"
+       ct_t="application/vnd.wap.multipart.related">
+    <parts>
+      <part seq="0" ct="text/plain" name="null" text="Gruppe hallo" />
+      <part seq="1" ct="image/png" name="bild.png" text="null"
+            data="AAAA" />
+    </parts>
+    <addrs>
+      <addr address="+49170" type="137" charset="106" />
+      <addr address="+49171" type="151" charset="106" />
+      <addr address="+49172" type="151" charset="106" />
+      <addr address="+49999" type="151" charset="106" />
+    </addrs>
+  </mms>
+  <mms date="1606000000000" msg_box="2" address="+49171~+49170~+49172"
+       contact_name="Bob, Anna, Carl"
+       ct_t="application/vnd.wap.multipart.related">
+    <parts>
+      <part seq="0" ct="text/plain" name="null" text="Antwort" />
+    </parts>
+    <addrs>
+      <addr address="insert-address-token" type="137" charset="106" />
+      <addr address="+49170" type="151" charset="106" />
+      <addr address="+49171" type="151" charset="106" />
+      <addr address="+49172" type="151" charset="106" />
+    </addrs>
+  </mms>
+  <mms date="1607000000000" msg_box="2" address="+49170~+49171~+49172"
+       contact_name="Anna, Bob, Carl"
+       ct_t="application/vnd.wap.multipart.related">
+    <parts>
+      <part seq="0" ct="text/plain" name="null" text="Von der eigenen Nummer" />
+    </parts>
+    <addrs>
+      <addr address="+49 999" type="137" charset="106" />
+      <addr address="+49170" type="151" charset="106" />
+      <addr address="+49171" type="151" charset="106" />
+      <addr address="+49172" type="151" charset="106" />
+    </addrs>
+  </mms>
+  <call number="+49170" duration="65" date="1601000000000" type="1"
+        contact_name="Anna" />
+</smses>
+"""
+
+
+class ReaderTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with tempfile.NamedTemporaryFile(
+                'w', suffix='.xml', encoding='utf-8', delete=False) as f:
+            f.write(BACKUP_XML)
+        cls.filename = f.name
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.filename)
+
+    def get_texts(self, **kw):
+        reader = Reader(self.filename, **kw)
+        return [m.get_text() for m in reader.get_all_messages()]
+
+
+class SelectiveLoadingTest(ReaderTest):
+    def test_all(self):
+        self.assertEqual(len(self.get_texts()), 7)
+
+    def test_types(self):
+        reader = Reader(self.filename, types={'call'})
+        self.assertEqual(reader.get_contacts_list(), ['Anna'])
+        self.assertEqual(len(reader.get_all_messages()), 1)
+        self.assertEqual(
+            self.get_texts(types=['sms']), ["Hallo", "Wer ist da?"])
+
+    def test_invalid_types(self):
+        with self.assertRaises(ValueError):
+            Reader(self.filename, types={'calls'})
+        with self.assertRaises(ValueError):
+            Reader(self.filename, types={'SMS'})
+        with self.assertRaises(TypeError):
+            Reader(self.filename, types='sms')
+        with self.assertRaises(TypeError):
+            Reader(self.filename, contacts='Anna')
+
+    def test_contact_name(self):
+        texts = self.get_texts(contacts=['Anna'])
+        self.assertEqual(len(texts), 5)
+        self.assertIn("Hallo", texts)
+        self.assertIn("Gruppe hallo", texts)
+        self.assertNotIn("Nur Carl", texts)
+
+    def test_contact_number_formatting(self):
+        self.assertEqual(
+            self.get_texts(contacts=['+49170'], types={'sms'}), ["Hallo"])
+        self.assertEqual(
+            self.get_texts(contacts=['+49 (222)']), ["Wer ist da?"])
+
+    def test_contact_in_group_mms(self):
+        self.assertEqual(
+            self.get_texts(contacts=['+49-171']),
+            ["Gruppe hallo", "Antwort", "Von der eigenen Nummer"])
+
+    def test_date_range(self):
+        texts = self.get_texts(since=1605000000, until=1607000000)
+        self.assertEqual(
+            texts, ["Gruppe hallo", "Antwort", "Von der eigenen Nummer"])
+        since = datetime.datetime.fromtimestamp(1606000000)
+        self.assertEqual(
+            self.get_texts(since=since),
+            ["Antwort", "Von der eigenen Nummer", "Wer ist da?"])
+        # a date means midnight at the start of that day:
+        until = datetime.datetime.fromtimestamp(1600000000).date()
+        self.assertEqual(self.get_texts(until=until), [])
+        self.assertEqual(
+            self.get_texts(until=until + datetime.timedelta(days=1)),
+            ["Hallo"])
+
+    def test_skipped_mms_parts(self):
+        # the group mms following Carl's mms is skipped, its parts and
+        # addrs must not end up in Carl's message:
+        reader = Reader(self.filename, types={'mms'}, until=1604500000)
+        self.assertEqual(reader.get_contacts_list(), ['Carl'])
+        message, = reader.get_all_messages()
+        self.assertEqual(message.get_text(), "Nur Carl")
+        self.assertFalse(message.has_data())
+        self.assertEqual(len(message.get_addresses()), 2)
+
+
+class GroupThreadsTest(ReaderTest):
+    def test_sent_and_received_share_key(self):
+        reader = Reader(self.filename)
+        self.assertEqual(len(reader.get_group_list()), 1)
+        key = reader.get_group_list()[0]
+        self.assertEqual(
+            [m.get_text() for m in reader.get_group_threads()[key]],
+            ["Gruppe hallo", "Antwort", "Von der eigenen Nummer"])
+
+    def test_own_number_left_out(self):
+        reader = Reader(self.filename)
+        key = reader.get_group_list()[0]
+        self.assertEqual(key, frozenset(['+49170', '+49171', '+49172']))
+        # also without the sent mms revealing the own number:
+        reader = Reader(self.filename, until=1605000000)
+        self.assertEqual(
+            reader.get_group_list(),
+            [frozenset(['+49170', '+49171', '+49172'])])
+
+    def test_group_name(self):
+        reader = Reader(self.filename)
+        key = reader.get_group_list()[0]
+        self.assertEqual(reader.get_group_name(key), "Anna, Bob, Carl")
+
+
+if __name__ == "__main__":
+    unittest.main()
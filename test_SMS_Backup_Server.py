@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of SMS_Backup_Server.py against a local client.
+
+Run with: python -m unittest
+
+"""
+
+import asyncio, base64, contextlib, io, json, os, tempfile, unittest
+
+from SMS_Backup_Parser import Reader
+from SMS_Backup_Server import BackupServer
+
+
+ATTACHMENT = bytes(range(256)) * 1000
+
+BACKUP_XML = """<?xml version='1.0' encoding='UTF-8' standalone='yes' ?>
+<smses count="6">
+  <sms protocol="0" address="+49 170" date="1600000000000" type="1"
+       body="Hallo &#55357;&#56832;" contact_name="Anna" />
+  <sms protocol="0" address="+49170" date="1600000100000" type="2"
+       body="Hi Anna" contact_name="Anna" />
+  <sms protocol="0" address="+49222" date="1610000000000" type="2"
+       body="Wer ist da?" contact_name="(Unknown)" />
+  <mms date="1605000000000" msg_box="1" address="+49170~+49171"
+       contact_name="Anna, Bob" ct_t="application/vnd.wap.multipart.related">
+    <parts>
+      <part seq="-1" ct="application/smil" name="null" text="&lt;smil&gt;" />
+      <part seq="0" ct="text/plain" name="null" text="Gruppe hallo" />
+      <part seq="1" ct="image/png" name="bild.png" text="null"
+            data="%s" />
+      <part seq="2" ct="image/png" name="kaputt.png" text="null"
+            data="AAA*" />
+    </parts>
+    <addrs>
+      <addr address="+49170" type="137" charset="106" />
+      <addr address="+49171" type="151" charset="106" />
+      <addr address="+49999" type="151" charset="106" />
+    </addrs>
+  </mms>
+  <mms date="1606000000000" msg_box="2" address="+49171~+49170"
+       contact_name="Bob, Anna" ct_t="application/vnd.wap.multipart.related">
+    <parts>
+      <part seq="0" ct="text/plain" name="null" text="Antwort an die Gruppe" />
+    </parts>
+    <addrs>
+      <addr address="insert-address-token" type="137" charset="106" />
+      <addr address="+49170" type="151" charset="106" />
+      <addr address="+49171" type="151" charset="106" />
+    </addrs>
+  </mms>
+  <call number="+49170" duration="65" date="1601000000000" type="1"
+        contact_name="Anna" />
+</smses>
+""" % base64.encodebytes(ATTACHMENT).decode().replace('\n', '&#10;')
+
+
+class BackupServerTest(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        with tempfile.NamedTemporaryFile(
+                'w', suffix='.xml', encoding='utf-8', delete=False) as f:
+            f.write(BACKUP_XML)
+        try:
+            cls.reader = Reader(f.name)
+        finally:
+            os.remove(f.name)
+
+    async def asyncSetUp(self):
+        self.server = await BackupServer(self.reader).start(port=0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def request(self, target, method="GET"):
+        """Send a request and return status, headers and body."""
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+        writer.write(("%s %s HTTP/1.1\r\nHost: localhost\r\n\r\n" % (
+            method, target)).encode('latin-1'))
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        await writer.wait_closed()
+        head, _, body = response.partition(b"\r\n\r\n")
+        lines = head.decode('latin-1').split("\r\n")
+        status = int(lines[0].split()[1])
+        headers = dict(line.split(": ", 1) for line in lines[1:])
+        self.assertEqual(int(headers["Content-Length"]), len(body))
+        return status, headers, body
+
+    async def get_json(self, target, expected_status=200):
+        status, headers, body = await self.request(target)
+        self.assertEqual(status, expected_status)
+        self.assertTrue(headers["Content-Type"].startswith(
+            "application/json"))
+        return json.loads(body.decode('utf-8'))
+
+    async def test_contacts(self):
+        result = await self.get_json("/contacts")
+        self.assertEqual(
+            [c["name"] for c in result["contacts"]],
+            self.reader.get_contacts_list())
+        self.assertEqual(len(result["groups"]), 1)
+        self.assertEqual(result["groups"][0]["name"], "Anna, Bob")
+
+    async def test_messages_pagination(self):
+        result = await self.get_json("/messages?offset=1&limit=2")
+        self.assertEqual(result["total"], 6)
+        self.assertEqual([m["id"] for m in result["messages"]], [1, 2])
+
+        result = await self.get_json("/messages?contact=Anna")
+        self.assertEqual(
+            [m["kind"] for m in result["messages"]], ["sms", "sms", "call"])
+        self.assertEqual(result["messages"][0]["text"], "Hallo \U0001F600")
+
+        result = await self.get_json("/messages?group=0")
+        self.assertEqual(
+            [m["text"] for m in result["messages"]],
+            ["Gruppe hallo", "Antwort an die Gruppe"])
+
+    async def test_search(self):
+        result = await self.get_json("/search?q=GRUPPE")
+        self.assertEqual(
+            [m["text"] for m in result["messages"]],
+            ["Gruppe hallo", "Antwort an die Gruppe"])
+        result = await self.get_json("/search?q=hi&contact=Anna")
+        self.assertEqual(
+            [m["text"] for m in result["messages"]], ["Hi Anna"])
+
+    async def test_attachment(self):
+        result = await self.get_json("/search?q=hallo&contact=Anna%2C%20Bob")
+        url = result["messages"][0]["attachments"][0]["url"]
+        status, headers, body = await self.request(url)
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["Content-Type"], "image/png")
+        self.assertEqual(body, ATTACHMENT)
+
+        # invalid base64 data must not be sent with a wrong length:
+        url = result["messages"][0]["attachments"][1]["url"]
+        await self.get_json(url, 500)
+
+    async def test_errors(self):
+        await self.get_json("/nope", 404)
+        await self.get_json("/messages?contact=Niemand", 404)
+        await self.get_json("/messages?group=5", 404)
+        await self.get_json("/messages?limit=x", 400)
+        await self.get_json("/messages?offset=-1", 400)
+        await self.get_json("/search", 400)
+        await self.get_json("/attachments/0", 400)
+        await self.get_json("/attachments/0/0", 404)
+        status, headers, body = await self.request("/contacts", "POST")
+        self.assertEqual(status, 405)
+
+    async def test_request_line_too_long(self):
+        status, headers, body = await self.request("/" + "x" * 70000)
+        self.assertEqual(status, 400)
+        # the server still works afterwards:
+        await self.get_json("/contacts")
+
+    async def test_timeout(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.server = await BackupServer(self.reader, timeout=0.1).start(
+            port=0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+        # send an incomplete request and wait:
+        writer.write(b"GET /contacts HTTP/1.1\r\n")
+        response = await asyncio.wait_for(reader.read(), 5)
+        writer.close()
+        await writer.wait_closed()
+        self.assertTrue(response.startswith(b"HTTP/1.1 408 "))
+
+    async def test_internal_error(self):
+        class FailingServer(BackupServer):
+            async def get_contacts(self, writer, path, query):
+                raise IndexError("list index out of range")
+
+        self.server.close()
+        await self.server.wait_closed()
+        self.server = await FailingServer(self.reader).start(port=0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        with contextlib.redirect_stderr(io.StringIO()):
+            result = await self.get_json("/contacts", 500)
+        self.assertEqual(result, {"error": "internal server error"})
+
+    async def test_concurrent_clients(self):
+        targets = ["/contacts", "/messages?limit=3", "/search?q=anna"] * 30
+        results = await asyncio.gather(
+            *[self.get_json(target) for target in targets])
+        for target, result in zip(targets, results):
+            self.assertEqual(result, await self.get_json(target))
+
+
+if __name__ == "__main__":
+    unittest.main()